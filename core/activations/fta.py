@@ -1,36 +1,38 @@
 import torch
+import torch.nn as nn
 import torch.nn.functional as functional
-import numpy as np
 
 
-class FTA:
-    
+class FTA(nn.Module):
+
     '''
     FUZZY TILING ACTIVATION
-    
+
     GPU utilized version of FTA
-    please refer to the main paper https://arxiv.org/abs/1911.08068v3 for more information about the parameters of 
+    please refer to the main paper https://arxiv.org/abs/1911.08068v3 for more information about the parameters of
     this activation function.
-    
+
+    implemented with torch ops only and the tiling centers registered as a buffer,
+    so the module is TorchScript-compatible and follows the network to its device.
+
     '''
-    
-    
+
+
     def __init__(self, tiles, bound_low, bound_high, eta, input_dim):
+        super(FTA, self).__init__()
         self.n_tilings = 1
         self.n_tiles = tiles
         self.bound_low, self.bound_high = bound_low, bound_high
         self.delta = (self.bound_high - self.bound_low) / self.n_tiles
-        self.c_mat = torch.as_tensor(np.array([self.delta * i for i in range(self.n_tiles)]) + self.bound_low, dtype=torch.float32)
-        self.c_mat = self.c_mat.to(device='cuda')
+        c_mat = torch.arange(self.n_tiles, dtype=torch.float32) * self.delta + self.bound_low
+        self.register_buffer('c_mat', c_mat)
         self.eta = eta
         self.d = input_dim
 
-    def __call__(self, reps):
-        temp = reps
-        temp = temp.reshape([-1, self.d, 1])
+    def forward(self, reps):
+        temp = reps.reshape(-1, self.d, 1)
         onehots = 1.0 - self.i_plus_eta(self.sum_relu(self.c_mat, temp))
-        onehots = onehots
-        out = torch.reshape(torch.reshape(onehots, [-1]), [-1, int(self.d * self.n_tiles * self.n_tilings)])
+        out = onehots.reshape(-1, self.d * self.n_tiles * self.n_tilings)
         return out
 
     def sum_relu(self, c, x):
@@ -38,7 +40,7 @@ class FTA:
         return out
 
     def i_plus_eta(self, x):
-        if self.eta == 0:
+        if self.eta == 0.0:
             return torch.sign(x)
-        out = (x <= self.eta).type(torch.float32) * x + (x > self.eta).type(torch.float32)
-        return out
\ No newline at end of file
+        out = (x <= self.eta).to(torch.float32) * x + (x > self.eta).to(torch.float32)
+        return out
@@ -1,13 +1,11 @@
 import torch
 import torch.nn as nn
+import numpy as np
 import os
 from pathlib import Path
-import random
 from tqdm import trange
-from itertools import count
 import matplotlib.pyplot as plt
 import matplotlib
-import math
 import datetime
 from core.utils import *
 from core.nn import Network
@@ -57,60 +55,155 @@ class Agent():
         if not os.path.exists(self.reward_dir):
             os.makedirs(self.reward_dir)
             
-        self.action_space = env.action_space.n
-        
+        # the environment is expected to be a (Async)VectorEnv running several
+        # copies of MazEnv, but a plain single env is accepted as well
+        self.num_envs = getattr(env, 'num_envs', 1)
+        if hasattr(env, 'single_action_space'):
+            self.action_space = env.single_action_space.n
+            obs_shape = env.single_observation_space.shape  # (H, W, C)
+        else:
+            self.action_space = env.action_space.n
+            obs_shape = env.observation_space.shape  # (H, W, C)
+
+        # whole-step CUDA graph capture of optimize; mutually exclusive with
+        # torch.compile below, whose reduce-overhead mode uses graphs on its own
+        self.use_cuda_graph = self.args.use_cuda_graph and torch.cuda.is_available()
+        self.cuda_graph = None
+        self.static_batch = None
+        self.will_compile = torch.cuda.is_available() and not self.use_cuda_graph
+
         # create policy and target networks
-        self.policy_net = Network(self.args.use_fta, self.args.use_aux).to(self.device)
-        self.target_net = Network(self.args.use_fta, self.args.use_aux).to(self.device)
+        # TorchScript and torch.compile do not stack (dynamo cannot trace into
+        # ScriptModules), so the inner blocks are only scripted when the nets
+        # are not going to be compiled below
+        self.policy_net = Network(self.args.use_fta, self.args.use_aux, script=not self.will_compile).to(self.device)
+        self.target_net = Network(self.args.use_fta, self.args.use_aux, script=not self.will_compile).to(self.device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
-        
+
         # define loss function and optimizer with hyperparameters set in config.yaml file
+        # the stateless functional form is kept around so optimize does not
+        # instantiate nn.MSELoss modules on every call
         self.loss_fn = nn.SmoothL1Loss()
-        self.optimizer = torch.optim.AdamW(self.policy_net.parameters(), lr=self.args.learning_rate, amsgrad=True)
+        self.mse = nn.functional.mse_loss
+        # capturable lets the AdamW update itself be recorded into a CUDA graph
+        self.optimizer = torch.optim.AdamW(self.policy_net.parameters(), lr=self.args.learning_rate,
+                                           amsgrad=True, capturable=self.use_cuda_graph)
         
         # create the replay buffer
-        self.memory = ReplayMemory(1000000)
+        # states are stored as uint8 NHWC images, exactly as the env emits them;
+        # the networks cast and permute on device in their own forward pass
+        self.memory = ReplayMemory(1000000, obs_shape, self.device)
+
+        # compile both networks so the many small conv/linear launches are fused;
+        # reduce-overhead additionally replays the step through CUDA graphs, which
+        # suits the small fixed-size batches used here
+        if self.will_compile:
+            self.policy_net = torch.compile(self.policy_net, mode="reduce-overhead", dynamic=False)
+            self.target_net = torch.compile(self.target_net, mode="reduce-overhead", dynamic=False)
+            # warm up compilation with a dummy state before the training loop
+            dummy = torch.zeros((1, *obs_shape), dtype=torch.uint8, device=self.device)
+            with torch.no_grad():
+                self.policy_net(dummy)
+                self.target_net(dummy)
         
+        # cached parameter and buffer lists so target-network updates run as
+        # fused multi-tensor kernels instead of rebuilding state_dicts every step
+        self.policy_params = list(self.policy_net.parameters())
+        self.target_params = list(self.target_net.parameters())
+        self.policy_buffers = list(self.policy_net.buffers())
+        self.target_buffers = list(self.target_net.buffers())
+
         self.steps_done = 0
+        self.accum_step = 0  # minibatches accumulated since the last optimizer step
         self.reward_in_episode = []
-        
+
+        # incrementally maintained reward curve and its 100-episode rolling mean,
+        # so plotting never rebuilds a tensor from the whole reward history
+        self._rewards_tensor = torch.zeros(self.args.max_episodes, dtype=torch.float)
+        self._reward_means = torch.zeros(self.args.max_episodes, dtype=torch.float)
+        self._rolling_sum = 0.0
+
+        # precomputed epsilon schedule: action selection does a table lookup
+        # instead of evaluating math.exp on every step; the table covers every
+        # possible env step of a run and the last entry is reused beyond that
+        max_steps = self.args.max_episodes * self.args.horizon
+        self.eps_table = self.args.eps_end + (self.args.eps_start - self.args.eps_end) * \
+            torch.exp(-torch.arange(0, max_steps, dtype=torch.float32) / self.args.eps_decay)
+
+    def _obs_to_state(self, observation):
+
+        '''
+        moves an observation to the device as-is: uint8 NHWC, no cast and no
+        transpose on the host; the staging copy goes through pinned memory so
+        the transfer can overlap with compute
+        '''
+
+        state = torch.from_numpy(np.ascontiguousarray(observation))
+        if self.device.type == 'cuda':
+            state = state.pin_memory()
+        return state.to(self.device, non_blocking=True)
+
     def select_action(self, state):
         
         '''
-        This function handles actions selection and also increases the steps_done which
-        decreases the epsilon for future action selections.
-        
+        This function handles action selection for the whole batch of environments
+        and also increases the steps_done which decreases the epsilon for future
+        action selections.
+
         inputs:
-            -state: current state of our agent
+            -state: batch of current states, one per environment
         outputs:
-            -an action based on epsilon-greedy action selection
+            -a (num_envs, 1) tensor of epsilon-greedy actions
         '''
-        
-        sample = random.random()
-        eps_threshold = self.args.eps_end + (self.args.eps_start - self.args.eps_end) * \
-            math.exp(-1. * self.steps_done / self.args.eps_decay)
-        self.steps_done += 1
-        if sample > eps_threshold:
-            with torch.no_grad():
-                '''
-                t.max(1) will return the largest column value of each row.
-                second column on max result is index of where max element was
-                found, so we pick action with the larger expected reward.
-                '''
-                return self.policy_net(state)[0].max(1)[1].view(1, 1)
-        else:
-            return torch.tensor([[self.env.action_space.sample()]], device=self.device, dtype=torch.long)
+
+        eps_threshold = self.eps_table[min(self.steps_done, self.eps_table.shape[0] - 1)]
+        self.steps_done += self.num_envs
+        # no_grad rather than inference_mode: the policy net may be a
+        # torch.compile'd module, and dynamo in the pinned torch 2.0 refuses
+        # to run compiled code under inference_mode
+        with torch.no_grad():
+            '''
+            t.max(1) will return the largest column value of each row.
+            second column on max result is index of where max element was
+            found, so we pick action with the larger expected reward.
+            '''
+            greedy = self.policy_net(state)[0].max(1)[1]
+            # exploration is decided branchlessly on device: one random tensor for
+            # the whole batch of envs, no Python-side RNG and no host sync
+            random_actions = torch.randint(0, self.action_space, greedy.shape, device=self.device)
+            explore = torch.rand(greedy.shape[0], device=self.device) <= eps_threshold
+            return torch.where(explore, random_actions, greedy).view(-1, 1)
             
             
+    def _log_episode_reward(self, reward):
+
+        '''
+        records one finished episode's reward, updating the cached reward curve
+        and its 100-episode rolling mean in O(1) per episode
+        '''
+
+        n = len(self.reward_in_episode)
+        self.reward_in_episode.append(reward)
+        if n >= self._rewards_tensor.shape[0]:
+            # several envs can finish on the very last vector step, grow if needed
+            self._rewards_tensor = torch.cat((self._rewards_tensor, torch.zeros_like(self._rewards_tensor)))
+            self._reward_means = torch.cat((self._reward_means, torch.zeros_like(self._reward_means)))
+        self._rewards_tensor[n] = reward
+        self._rolling_sum += reward
+        if n >= 100:
+            self._rolling_sum -= float(self._rewards_tensor[n - 100])
+        if n >= 99:
+            self._reward_means[n] = self._rolling_sum / 100.0
+
     def plot_rewards(self, show_result=False):
-        
+
         '''
         This function handles the online reward plottings
-        To plot rewards, set plot_during_training to True in config.yaml file 
+        To plot rewards, set plot_during_training to True in config.yaml file
         '''
-        
+
         plt.figure(1)
-        rewards_t = torch.tensor(self.reward_in_episode, dtype=torch.float)
+        n = len(self.reward_in_episode)
         if show_result:
             plt.title('Result')
         else:
@@ -118,11 +211,9 @@ class Agent():
             plt.title('Training...')
         plt.xlabel('Episode')
         plt.ylabel('Rewards')
-        plt.plot(rewards_t.numpy())
-        if len(rewards_t) >= 100:
-            means = rewards_t.unfold(0, 100, 1).mean(1).view(-1)
-            means = torch.cat((torch.zeros(99), means))
-            plt.plot(means.numpy())
+        plt.plot(self._rewards_tensor[:n].numpy())
+        if n >= 100:
+            plt.plot(self._reward_means[:n].numpy())
 
         plt.pause(0.001)
         if is_ipython:
@@ -132,107 +223,191 @@ class Agent():
             else:
                 display.display(plt.gcf())
                 
+    def _compute_loss(self, batch):
+
+        '''
+        computes the full training loss (Q learning plus the active auxiliary
+        task) for one sampled batch; shared by the eager optimization path and
+        the CUDA graph capture, which records exactly these ops
+        '''
+
+        state_batch = batch['states']
+        action_batch = batch['actions']
+        reward_batch = batch['rewards']
+        next_state_batch = batch['next_states']
+        non_final_mask = batch['non_final_mask']
+
+        if self.need_next:
+            next_action_batch = batch['next_actions']
+
+        # whether the DQN target runs on the full next-state batch and gets
+        # masked afterwards: required when the aux bootstraps reuse the target
+        # outputs, and under CUDA graph capture, where boolean-mask indexing is
+        # forbidden (it calls nonzero, which syncs and yields dynamic shapes)
+        full_target = self.need_next or self.use_cuda_graph
+
+
+        # forward passes and loss math run in bfloat16 on tensor cores when a GPU
+        # is available; bf16 keeps the fp32 exponent range, so no GradScaler is
+        # needed, and the backward pass below autocasts itself to match
+        with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16,
+                            enabled=self.device.type == 'cuda'):
+
+            # the net_return is in the form of -> [x, aux, rep, reward]
+            net_return = self.policy_net(state_batch)
+            state_action_values = net_return[0].gather(1, action_batch)
+
+            # same story as select_action: the target net may be compiled, so
+            # the bootstrap values are computed under no_grad, not inference_mode
+            with torch.no_grad():
+                if full_target:
+                    target_return = self.target_net(next_state_batch)
+                    masked_state_values = torch.where(non_final_mask, target_return[0].max(1)[0], 0.0)
+                else:
+                    # the eager-only path still skips the final states entirely
+                    target_return = None
+                    non_final_next_states = next_state_batch[non_final_mask]
+                    target_state_values = self.target_net(non_final_next_states)[0].max(1)[0]
+            if full_target:
+                next_state_values = masked_state_values
+            else:
+                # under autocast the target values come out bfloat16 while the
+                # zeros are float32, and masked assignment does not promote, so
+                # the values are cast up front (a no-op when autocast is off)
+                next_state_values = torch.zeros(self.args.batch_size, device=self.device)
+                next_state_values[non_final_mask] = target_state_values.float()
+
+            # Compute the bootstraped Q values
+            expected_state_action_values = (next_state_values * self.args.gamma) + reward_batch
+
+            # calcualte the loss -> make state_action_values more like bootstraped values
+            loss = self.mse(state_action_values, expected_state_action_values.unsqueeze(1))
+
+            # if it is not a transfer task, then we might have some auxiliary tasks as well
+            if not self.args.transfer:
+
+                # check if we have auxiliary tasks and calculate their losses
+                # we add the auxiliary losses to the main loss (there might be a special weight for each which is set in config.yaml)
+                if self.args.use_aux != None:
+
+                    # Input Reconstruction auxiliary task
+                    if self.args.use_aux == 'ir':
+                        aux_return = net_return[1]
+
+                        # the reconstruction head emits float NCHW, the stored states are uint8 NHWC
+                        ir_target = state_batch.permute(0, 3, 1, 2).float()
+                        loss = loss + self.args.aux_loss_weight * self.mse(aux_return, ir_target)
+
+                    # Reward Prediction auxiliary task
+                    if self.args.use_aux == 'reward':
+                        aux_return = net_return[1]
+                        rb = torch.reshape(reward_batch, (self.args.batch_size, -1))
+                        loss = loss + self.mse(aux_return, rb)
+
+                    # Successor Features auxiliary task
+                    if self.args.use_aux == 'sf':
+                        aux_return = net_return[1]
+                        representation_st = net_return[2]
+                        next_state_rec = net_return[3]
+
+                        with torch.no_grad():
+                            next_state_aux_return = target_return[1].gather(1, next_action_batch)
+
+                        loss_to_add = self.args.aux_loss_weight * self.mse(aux_return, representation_st + self.args.gamma * next_state_aux_return)
+
+                        # the reconstruction head emits float NCHW, the stored states are uint8 NHWC
+                        next_rep_target = next_state_batch.permute(0, 3, 1, 2).float()
+                        loss = loss + loss_to_add + self.mse(next_state_rec, next_rep_target)
+
+                    # Virtual Value Functions auxiliary tasks
+                    if self.args.use_aux == 'virtual-reward-1' or self.args.use_aux == 'virtual-reward-5':
+                        virtual_reward_batch = batch['virtual_rewards']
+                        action_values = net_return[1].gather(1, action_batch)
+                        with torch.no_grad():
+                            next_state_virtual_action_values = target_return[1].gather(1, next_action_batch)
+                            bootstraped_value = (virtual_reward_batch + self.args.gamma * next_state_virtual_action_values.squeeze())
+
+                        loss = loss + self.mse(action_values, bootstraped_value.unsqueeze(1))
+
+        return loss
+
     def optimize(self, i):
-        
+
         '''
         OPTIMIZATION
         '''
-        
+
         # check if replay buffer has enough transition samples
         if len(self.memory) < self.args.batch_size:
             return
-        transitions = self.memory.sample(self.args.batch_size)
-        batch = Transition(*zip(*transitions))
-
-        # Compute a mask of non-final states and concatenate the batch elements
-        # (a final state would've been the one after which simulation ended)
-        
-        non_final_mask = torch.tensor(tuple(map(lambda s: s is not None,
-                                            batch.next_state)), device=self.device, dtype=torch.bool)
-        non_final_next_states = torch.cat([s for s in batch.next_state
-                                                    if s is not None])
-        state_batch = torch.cat(batch.state)
-        action_batch = torch.cat(batch.action)
-        reward_batch = torch.cat(batch.reward)
-        
-        
-        if self.need_next:
-            next_action_batch = torch.cat(batch.next_action)
-            next_state_batch = torch.cat(batch.next_state)
-            
+        # the sampled batch is a dict of already-stacked tensors on self.device,
+        # the mask of non-final states comes straight from the buffer
+        batch = self.memory.sample(self.args.batch_size)
 
-        # the net_return is in the form of -> [x, aux, rep, reward]
-        net_return = self.policy_net(state_batch)
-        state_action_values = net_return[0].gather(1, action_batch)
+        if self.use_cuda_graph:
+            self._optimize_graphed(batch)
+            return
 
-        next_state_values = torch.zeros(self.args.batch_size, device=self.device)
-        with torch.no_grad():
-            next_state_values[non_final_mask] = self.target_net(non_final_next_states)[0].max(1)[0]
-            
-        # Compute the bootstraped Q values
-        expected_state_action_values = (next_state_values * self.args.gamma) + reward_batch
- 
-        criterion = nn.MSELoss()
-        
-        # calcualte the loss -> make state_action_values more like bootstraped values
-        loss = criterion(state_action_values, expected_state_action_values.unsqueeze(1))
+        loss = self._compute_loss(batch)
 
-        # if it is not a transfer task, then we might have some auxiliary tasks as well
-        if not self.args.transfer:
-            
-            # check if we have auxiliary tasks and calculate their losses
-            # we add the auxiliary losses to the main loss (there might be a special weight for each which is set in config.yaml)
-            if self.args.use_aux != None:
-                
-                # Input Reconstruction auxiliary task
-                if self.args.use_aux == 'ir':
-                    aux_return = net_return[1]
-                    aux_loss = nn.MSELoss()
-                    
-                    loss = loss + self.args.aux_loss_weight * aux_loss(aux_return, state_batch)
-                
-                # Reward Prediction auxiliary task
-                if self.args.use_aux == 'reward':
-                    aux_return = net_return[1]
-                    aux_loss = nn.MSELoss()
-                    rb = torch.reshape(reward_batch, (self.args.batch_size, -1))
-                    loss = loss + aux_loss(aux_return, rb)
-                    
-                # Successor Features auxiliary task
-                if self.args.use_aux == 'sf':
-                    aux_return = net_return[1]
-                    representation_st = net_return[2]
-                    next_state_rec = net_return[3]
-
-                    with torch.no_grad(): 
-                        next_state_aux_return = self.target_net(next_state_batch)[1].gather(1, next_action_batch)
-                    
-                    aux_loss = nn.MSELoss()
-                    next_rep_loss = nn.MSELoss()
-
-                    loss_to_add = self.args.aux_loss_weight * aux_loss(aux_return, representation_st + self.args.gamma * next_state_aux_return) 
-
-                    loss = loss + loss_to_add + next_rep_loss(next_state_rec, next_state_batch)
-                            
-                # Virtual Value Functions auxiliary tasks
-                if self.args.use_aux == 'virtual-reward-1' or self.args.use_aux == 'virtual-reward-5':
-                    virtual_reward_batch = torch.cat(batch.virtual_reward)
-                    action_values = net_return[1].gather(1, action_batch)
-                    with torch.no_grad():
-                        next_state_virtual_action_values = self.target_net(next_state_batch)[1].gather(1, next_action_batch)
-                        bootstraped_value = (virtual_reward_batch + self.args.gamma * next_state_virtual_action_values.squeeze())
-
-                    aux_loss = nn.MSELoss()       
-                    
-                    loss = loss + aux_loss(action_values, bootstraped_value.unsqueeze(1))
-        
         # Optimize the model
-        self.optimizer.zero_grad()
+        # gradients of accumulation_steps minibatches are accumulated before a
+        # single clipped optimizer step, which amortizes the fixed overhead of
+        # the clip and the AdamW update; dividing the loss keeps the math equal
+        loss = loss / self.args.accumulation_steps
         loss.backward()
-        # In-place gradient clipping
-        torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
-        self.optimizer.step()
-        
+        self.accum_step += 1
+        if self.accum_step == self.args.accumulation_steps:
+            # In-place gradient clipping
+            torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
+            self.optimizer.step()
+            self.optimizer.zero_grad(set_to_none=True)
+            self.accum_step = 0
+
+    def _optimize_graphed(self, batch):
+
+        '''
+        runs the optimization step by replaying a captured CUDA graph
+
+        the first call records forward, loss, backward, gradient clipping and
+        the AdamW update into a graph operating on static buffers (after a few
+        warmup iterations on a side stream, as capture requires); later calls
+        just copy the sampled batch into those buffers and replay the recorded
+        kernels as a single unit, eliminating all per-kernel launch overhead
+
+        the graph contains exactly one optimizer update, so accumulation_steps
+        does not apply on this path; shapes are fixed by the batch size
+        '''
+
+        if self.cuda_graph is None:
+            self.static_batch = {k: v.clone() for k, v in batch.items()}
+
+            # warm up on a side stream before capture, as required by CUDA graphs
+            side_stream = torch.cuda.Stream()
+            side_stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(side_stream):
+                for _ in range(3):
+                    self.optimizer.zero_grad(set_to_none=False)
+                    loss = self._compute_loss(self.static_batch)
+                    loss.backward()
+                    torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
+                    self.optimizer.step()
+            torch.cuda.current_stream().wait_stream(side_stream)
+
+            self.cuda_graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(self.cuda_graph):
+                # the warmup above materialized static .grad tensors, so zeroing
+                # them is recorded as the first kernels of the graph
+                self.optimizer.zero_grad(set_to_none=False)
+                loss = self._compute_loss(self.static_batch)
+                loss.backward()
+                torch.nn.utils.clip_grad_value_(self.policy_net.parameters(), 100)
+                self.optimizer.step()
+        else:
+            for key, value in batch.items():
+                self.static_batch[key].copy_(value)
+            self.cuda_graph.replay()
+
     
     def _save(self):
         '''
@@ -244,111 +419,167 @@ class Agent():
                         
                 
         if self.args.save_model:
-            torch.save(self.target_net.state_dict(), f'{self.model_dir}/pytorch_{self.id}.pt')
-    
+            # save the state of the underlying module: torch.compile wraps the
+            # nets in an OptimizedModule whose state_dict keys carry an
+            # _orig_mod. prefix, so going through the wrapped module keeps the
+            # checkpoint format independent of whether compile is active
+            net = getattr(self.target_net, '_orig_mod', self.target_net)
+            torch.save(net.state_dict(), f'{self.model_dir}/pytorch_{self.id}.pt')
+
+    def load_model(self, model_path):
+        '''
+        load a saved checkpoint into both policy and target networks
+
+        the state_dict is loaded into the modules underlying torch.compile
+        (when active), so checkpoints written on any box load on any other
+        '''
+        state_dict = torch.load(model_path, map_location=self.device)
+        getattr(self.policy_net, '_orig_mod', self.policy_net).load_state_dict(state_dict)
+        getattr(self.target_net, '_orig_mod', self.target_net).load_state_dict(state_dict)
+
     def train(self):
-        
+
         '''
         The main training loop of our agent
-        
-        iterates for max_episodes or reaching a number of consecutive sucseeful episodes with a reward of 1
-        this can be set in config.yaml file
-        
-        self.optimize if called in each iteration to optimize the agent's networks
+
+        the vectorized environment steps num_envs copies of MazEnv at once, so every
+        iteration of the loop below collects num_envs transitions and runs a single
+        optimization step, which preserves the update-to-sample ratio of a serial loop
+
+        runs until max_episodes episodes have finished or after reaching a number of
+        consecutive successful episodes with a reward of 1, both set in config.yaml
+        (episode truncation at the horizon is handled by the TimeLimit wrapper)
         '''
-        
+
         consecutive_episodes = 0
-        
-        # iterate for args.max_episodes episode
-        # this loop will be terminated if agent reach a args.consecutive_episodes number of successful consecutive episodes
-        for i in trange(self.args.max_episodes):
-            
-            reward_in_episode = 0   # reward recieved in current episode
-            state, info = self.env.reset()  # initiate the first position of agent
-            state = state.transpose((2, 0, 1))  # torch uses BGR but our state is RGB
-            state = torch.tensor(state, dtype=torch.float32, device=self.device).unsqueeze(0)   # convert numpy state to torch tensor
-            
-            # iterate over a number of steps untill reaching terminal state or horizon defined in config.yaml
-            for t in count():
-                # select action based on an epsilon-greedy approach
-                action = self.select_action(state)
-                if self.need_next:  # check if the current auxiliary task requires next state and next action
-                    if t > 0:
-                        # vvf auxiliary tasks also require virtual reward which is handled here and added to replay buffer
-                        if self.args.use_aux == 'virtual-reward-1' or self.args.use_aux == 'virtual-reward-5':
-                            virtual_reward = torch.tensor([info['virtual-reward']], device=self.device)
-
-                            self.memory.push(previous_state, previous_action, state, reward, action, virtual_reward)
-                            self.optimize(i)
-                        
-                        else:
-                            self.memory.push(previous_state, previous_action, state, reward, action, None)
-                            self.optimize(i)
-
-                # step in the environment to recieve reward and next_state (observation)
-                observation, reward, terminated, truncated, info = self.env.step(action.item())
-                observation = observation.transpose((2, 0, 1))
-
-                # convert numpy arrays to tensors
-                reward = torch.tensor([reward], device=self.device)
-                done = terminated or truncated
-                next_state = torch.tensor(observation, dtype=torch.float32, device=self.device).unsqueeze(0)
-
-                # store transitions in memory
-                if not self.need_next:
-                    self.memory.push(state, action, next_state, reward, None, None)
-                    self.optimize(i)
-                
-                # update previous actions and next state
-                previous_action = action
-                previous_state = state
-                state = next_state
-                reward_in_episode += reward
-                
-                # update target network weights
-                if self.args.soft_target_update:
-                    target_net_state_dict = self.target_net.state_dict()
-                    policy_net_state_dict = self.policy_net.state_dict()
-                    for key in policy_net_state_dict:
-                        target_net_state_dict[key] = policy_net_state_dict[key]*self.args.tau + target_net_state_dict[key]*(1-self.args.tau)
-                    self.target_net.load_state_dict(target_net_state_dict)
-                
-                # check if reached horizon to truncate
-                if done or t > self.args.horizon:
-                    if self.need_next:
-                        if self.args.use_aux == 'virtual-reward-1' or self.args.use_aux == 'virtual-reward-5':
-                            virtual_reward = torch.tensor([info['virtual-reward']], device=self.device)
-                            self.memory.push(previous_state, previous_action, state, reward, action, virtual_reward)
-                            self.optimize(i)
-                        else:
-                            self.memory.push(previous_state, previous_action, state, reward, action, None)
-                            self.optimize(i)
-                    
-                    self.reward_in_episode.append(reward_in_episode)
+        is_vvf = self.args.use_aux == 'virtual-reward-1' or self.args.use_aux == 'virtual-reward-5'
+
+        states, infos = self.env.reset()  # initiate the first position of the agents
+        states = self._obs_to_state(states)
+
+        # rewards are plain host-side scalars from the env; accumulating them in
+        # numpy avoids creating a GPU tensor and syncing back every step
+        episode_rewards = np.zeros(self.num_envs)  # reward recieved in each env's running episode
+
+        # per-env bookkeeping for auxiliary tasks that require the next action:
+        # those transitions are pushed one step late, once the action taken in their
+        # next state is known, and prev_valid marks the envs holding a pending one
+        prev_states = torch.zeros_like(states)
+        prev_actions = torch.zeros((self.num_envs, 1), dtype=torch.long, device=self.device)
+        prev_rewards = np.zeros(self.num_envs)
+        prev_virtual_rewards = np.zeros(self.num_envs)
+        prev_valid = np.zeros(self.num_envs, dtype=bool)
+
+        episodes_done = 0
+        pbar = trange(self.args.max_episodes)
+
+        while episodes_done < self.args.max_episodes:
+            # select actions for the whole batch of envs based on an epsilon-greedy approach
+            actions = self.select_action(states)
+
+            if self.need_next and prev_valid.any():  # check if the current auxiliary task requires next state and next action
+                # the transitions pending from the previous step are completed by the
+                # freshly selected actions and written to the buffer in one batch
+                # (vvf auxiliary tasks also require the stored virtual rewards)
+                sel = torch.as_tensor(np.flatnonzero(prev_valid), device=self.device)
+                virtual = prev_virtual_rewards[prev_valid] if is_vvf else None
+                self.memory.push_batch(prev_states[sel], prev_actions[sel], states[sel],
+                                       prev_rewards[prev_valid], actions[sel], virtual)
+
+            # step in all environments at once to recieve rewards and next states
+            observations, rewards, terminateds, truncateds, infos = self.env.step(actions.squeeze(1).cpu().numpy())
+
+            next_states = self._obs_to_state(observations)
+            dones = np.logical_or(terminateds, truncateds)
+
+            # autoreset already swapped terminal observations for the first state of
+            # the next episode; restore them from the infos for the stored transitions
+            if dones.any():
+                true_next_states = next_states.clone()
+                for e in np.flatnonzero(dones):
+                    true_next_states[e] = self._obs_to_state(infos['final_observation'][e])
+            else:
+                true_next_states = next_states
+
+            # store transitions in memory, one batched write per vector step
+            if not self.need_next:
+                self.memory.push_batch(states, actions, true_next_states, rewards)
+            else:
+                # terminal transitions are complete right away, reusing the current
+                # action as the next action since none is selected in a terminal state
+                for e in np.flatnonzero(dones):
+                    if is_vvf:
+                        virtual_reward = infos['final_info'][e]['virtual-reward']
+                    else:
+                        virtual_reward = None
+                    self.memory.push(states[e], actions[e], true_next_states[e], rewards[e], actions[e], virtual_reward)
+
+                # the other transitions stay pending until their next action is known
+                not_done = ~dones
+                sel = torch.as_tensor(np.flatnonzero(not_done), device=self.device)
+                prev_states[sel] = states[sel]
+                prev_actions[sel] = actions[sel]
+                prev_rewards[not_done] = rewards[not_done]
+                if is_vvf:
+                    for e in np.flatnonzero(not_done):
+                        prev_virtual_rewards[e] = float(infos['virtual-reward'][e])
+                prev_valid = not_done
+
+            # one optimization step per vector step (num_envs new transitions)
+            self.optimize(episodes_done)
+
+            episode_rewards += rewards
+
+            # update target network weights
+            # target <- target + tau * (policy - target), all parameters in a
+            # single fused lerp instead of one kernel per tensor via state_dicts
+            if self.args.soft_target_update:
+                with torch.no_grad():
+                    torch._foreach_lerp_(self.target_params, self.policy_params, self.args.tau)
+
+            # close the books on every episode that finished during this step
+            for e in range(self.num_envs):
+                if dones[e]:
+                    reward_in_episode = float(episode_rewards[e])
+                    episode_rewards[e] = 0
+                    self._log_episode_reward(reward_in_episode)
                     if(reward_in_episode == 1):
                         consecutive_episodes += 1
                     else:
                         consecutive_episodes = 0
-                    
+
+                    episodes_done += 1
+                    pbar.update(1)
+
                     if self.args.plot_during_training:
                         self.plot_rewards()
-                    break
-            
+
+                    if not self.args.soft_target_update:
+                        if episodes_done % self.args.target_update == 0:
+                            # copy parameters (and buffers) straight through the
+                            # cached lists, with no state_dict materialization;
+                            # a plain loop because torch._foreach_copy_ only
+                            # exists from pytorch 2.1 and the env pins 2.0
+                            with torch.no_grad():
+                                for t, p in zip(self.target_params, self.policy_params):
+                                    t.copy_(p)
+                                for t, b in zip(self.target_buffers, self.policy_buffers):
+                                    t.copy_(b)
+
+                    # save networks with a frequency defined in config.yaml
+                    if episodes_done % self.args.save_ratio == 0:
+                        self._save()
+
             # check for consecutive successful episodes
-            if consecutive_episodes == self.args.consecutive_episodes:
+            if consecutive_episodes >= self.args.consecutive_episodes:
                 self._save()
                 break
-            
-            if not self.args.soft_target_update:
-                if i % self.args.target_update == 0:
-                    self.target_net.load_state_dict(self.policy_net.state_dict())
-            
-            # save networks with a frequency defined in config.yaml
-            if i % self.args.save_ratio == 0:
-                self._save()
-        
+
+            states = next_states
+
+        pbar.close()
+
         if self.args.plot_during_training:
             self.plot_rewards(show_result=True)
             plt.ioff()
             plt.show()
-        
\ No newline at end of file
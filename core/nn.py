@@ -2,50 +2,59 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from core.activations.fta import FTA
-import numpy as np
 
 # Neural Networks Implementations
 
 
+def _maybe_script(module, script):
+
+    '''
+    scripts a pure-tensor block with TorchScript, fusing its in-place ReLUs
+    with the surrounding matmuls instead of launching every op from Python
+
+    scripting is skipped when the whole network is going to be wrapped in
+    torch.compile: dynamo cannot trace into ScriptModules, so a scripted
+    block would only break the compiled graph apart
+    '''
+
+    return torch.jit.script(module) if script else module
+
+
 # Successor Feature auxiliary head
 class SFNetwork(nn.Module):
-    def __init__(self, use_fta):
+    def __init__(self, use_fta, script=True):
         super().__init__()
         self.use_fta = use_fta
-        
+
         if self.use_fta:
-            self.linear1 = nn.Linear(640, 640)
-            self.linear2 = nn.Linear(640, 640)
+            rep_dim = 640
         else:
-            self.linear1 = nn.Linear(32, 32)
-            self.linear2 = nn.Linear(32, 32)
-        
+            rep_dim = 32
+        self.net = _maybe_script(nn.Sequential(nn.Linear(rep_dim, rep_dim),
+                                               nn.ReLU(inplace=True),
+                                               nn.Linear(rep_dim, rep_dim)), script)
+
     def forward(self, x):
-        x = F.relu(self.linear1(x))
-        x = self.linear2(x)
-        
-        return x
-        
-        
+        return self.net(x)
+
+
 # Reward Prediction auxiliary head
 class Reward(nn.Module):
-    def __init__(self, use_fta):
+    def __init__(self, use_fta, script=True):
         super().__init__()
         self.use_fta = use_fta
         if self.use_fta:
-            self.linear1 = nn.Linear(640, 1024)
+            rep_dim = 640
         else:
-            self.linear1 = nn.Linear(32, 1024)
-        
-        self.linear2 = nn.Linear(1024, 128)
-        self.linear3 = nn.Linear(128, 1)
-        
+            rep_dim = 32
+        self.net = _maybe_script(nn.Sequential(nn.Linear(rep_dim, 1024),
+                                               nn.ReLU(inplace=True),
+                                               nn.Linear(1024, 128),
+                                               nn.ReLU(inplace=True),
+                                               nn.Linear(128, 1)), script)
+
     def forward(self, x):
-        x = F.relu(self.linear1(x))
-        x = F.relu(self.linear2(x))
-        x = self.linear3(x)
-        
-        return x
+        return self.net(x)
         
 # Input Reconstruction auxiliary head
 class InputReconstruction(nn.Module):
@@ -56,38 +65,59 @@ class InputReconstruction(nn.Module):
         else:
             self.linear = nn.Linear(32, 1024)
         self.unflat = nn.Unflatten(1, (16, 8, 8))
-        self.convT1 = nn.ConvTranspose2d(16, 32, kernel_size=4, stride=2, padding=2)
-        self.convT2 = nn.ConvTranspose2d(32, 3, kernel_size=4, stride=1, padding=1)
-        
+        # dense conv + pixel-shuffle upsampling instead of transpose convolutions:
+        # same 15x15 output, but dense convs hit the fast cuDNN paths and avoid
+        # the overlapping-stride pattern (and its checkerboard gradients)
+        self.conv1 = nn.Conv2d(16, 32 * 4, kernel_size=3, padding=1)
+        self.shuffle = nn.PixelShuffle(2)
+        self.conv2 = nn.Conv2d(32, 3, kernel_size=2)
+        self._register_load_state_dict_pre_hook(self._remap_legacy_keys)
+
+    def _remap_legacy_keys(self, state_dict, prefix, local_metadata, strict,
+                           missing_keys, unexpected_keys, error_msgs):
+
+        '''
+        checkpoints written before the pixel-shuffle upsampler hold
+        transpose-conv weights; rebuild the matching modules in place so those
+        models still load and reconstruct exactly as they were trained
+        '''
+
+        if prefix + 'convT1.weight' not in state_dict:
+            return
+        device = self.linear.weight.device
+        self.conv1 = nn.ConvTranspose2d(16, 32, kernel_size=4, stride=2, padding=2).to(device)
+        self.shuffle = nn.Identity()
+        self.conv2 = nn.ConvTranspose2d(32, 3, kernel_size=4, stride=1, padding=1).to(device)
+        for old, new in (('convT1', 'conv1'), ('convT2', 'conv2')):
+            for suffix in ('.weight', '.bias'):
+                state_dict[prefix + new + suffix] = state_dict.pop(prefix + old + suffix)
+
     def forward(self, x):
         x = F.relu(self.linear(x))
         x = self.unflat(x)
-        x = F.relu(self.convT1(x))
-        x = F.relu(self.convT2(x))
-        
+        x = F.relu(self.shuffle(self.conv1(x)))  # 8x8 -> 16x16
+        x = F.relu(self.conv2(x))  # 16x16 -> 15x15
+
         return x
     
 # Virtual Value Function auxiliary head
 class VirtualValueFunction(nn.Module):
-    def __init__(self, use_fta):
+    def __init__(self, use_fta, script=True):
         super(VirtualValueFunction, self).__init__()
         self.use_fta = use_fta
 
         if self.use_fta:
-            self.q_network_fc1 = nn.Linear(640, 64)
+            rep_dim = 640
         else:
-            self.q_network_fc1 = nn.Linear(32, 64)
-            
-        self.q_network_fc2 = nn.Linear(64, 64)
-        self.q_network_fc3 = nn.Linear(64, 4)
-        
+            rep_dim = 32
+        self.net = _maybe_script(nn.Sequential(nn.Linear(rep_dim, 64),
+                                               nn.ReLU(inplace=True),
+                                               nn.Linear(64, 64),
+                                               nn.ReLU(inplace=True),
+                                               nn.Linear(64, 4)), script)
+
     def forward(self, x):
-        
-        x = F.relu(self.q_network_fc1(x))
-        x = F.relu(self.q_network_fc2(x))
-        x = self.q_network_fc3(x)
-        
-        return x
+        return self.net(x)
     
     
 # Main Representations of states network
@@ -98,23 +128,24 @@ class RepresentationNetwork(nn.Module):
         self.use_fta = use_fta
         self.conv1 = nn.Conv2d(3, 32, kernel_size=4, stride=1, padding=1)
         self.conv2 = nn.Conv2d(32, 16, kernel_size=4, stride=2, padding=2)
-        self.flatten = nn.Flatten()
-        self.fc1 = nn.Linear(8*8*16, 32)
-        self.fta = FTA(tiles=20, bound_low=-2, bound_high=+2, eta=0.4, input_dim=32)
-    
+        # the choice between FTA and ReLU is resolved once here instead of
+        # branching on every forward, keeping the traced graph branch-free
+        if self.use_fta:
+            self.head = nn.Sequential(nn.Linear(8*8*16, 32),
+                                      FTA(tiles=20, bound_low=-2, bound_high=+2, eta=0.4, input_dim=32))
+        else:
+            self.head = nn.Sequential(nn.Linear(8*8*16, 32), nn.ReLU())
+
     def forward(self, x):
-        x = x/255.0
+        # states arrive as uint8 NHWC straight from the environment, the cast to
+        # float and the NCHW permute happen here on device instead of per env step
+        x = x.permute(0, 3, 1, 2).float().mul_(1.0/255.0)
         x = F.relu(self.conv1(x))
 
         x = F.relu(self.conv2(x))
-        x = self.flatten(x)
-        x = x.reshape((-1, 1024))
-        
-        if self.use_fta:
-            rep = self.fta(self.fc1(x))
-        else:
-            rep = F.relu(self.fc1(x))
-        
+        x = x.flatten(1)
+        rep = self.head(x)
+
         return rep
         
 
@@ -127,40 +158,87 @@ class Network(nn.Module):
                                     --> Action Value Network
     input image -> rep network --> 
                                     --> Auxiliary Network
-    
+
     '''
-    def __init__(self, use_fta, use_aux=None):
+
+    # state_dict keys of checkpoints written before the heads were restructured
+    # into Sequential blocks, mapped to their current names
+    _legacy_key_map = {
+        'rep_net.fc1.': 'rep_net.head.0.',
+        'q_network_fc1.': 'q_head.0.',
+        'q_network_fc2.': 'q_head.2.',
+        'q_network_fc3.': 'q_head.4.',
+        'aux_network.linear1.': 'aux_network.net.0.',
+        'aux_network.linear2.': 'aux_network.net.2.',
+        'aux_network.linear3.': 'aux_network.net.4.',
+        'aux_network.q_network_fc1.': 'aux_network.net.0.',
+        'aux_network.q_network_fc2.': 'aux_network.net.2.',
+        'aux_network.q_network_fc3.': 'aux_network.net.4.',
+    }
+
+    def __init__(self, use_fta, use_aux=None, script=True):
         super(Network, self).__init__()
         self.use_fta = use_fta
         self.use_aux = use_aux
-        self.rep_net = RepresentationNetwork(use_fta=self.use_fta)
+        # the representation network and the Q head are pure tensor code, so they
+        # are scripted here (unless the agent is going to torch.compile the whole
+        # net instead) while the use_aux branching below stays in eager
+        self.rep_net = _maybe_script(RepresentationNetwork(use_fta=self.use_fta), script)
         if self.use_fta:
-            self.q_network_fc1 = nn.Linear(640, 64)
+            self.q_head = nn.Sequential(nn.Linear(640, 64), nn.ReLU(inplace=True),
+                                        nn.Linear(64, 64), nn.ReLU(inplace=True),
+                                        nn.Linear(64, 4))
         else:
-            self.q_network_fc1 = nn.Linear(32, 64)
+            self.q_head = nn.Sequential(nn.Linear(32, 64), nn.ReLU(inplace=True),
+                                        nn.Linear(64, 64), nn.ReLU(inplace=True),
+                                        nn.Linear(64, 4))
+        self.q_head = _maybe_script(self.q_head, script)
 
         if self.use_aux != "no_aux":
             if self.use_aux == 'ir':
                 self.aux_network = InputReconstruction(use_fta=self.use_fta)
             elif self.use_aux == 'reward':
-                self.aux_network = Reward(use_fta=self.use_fta)
+                self.aux_network = Reward(use_fta=self.use_fta, script=script)
             elif self.use_aux == 'sf':
-                self.aux_network = SFNetwork(use_fta=self.use_fta)
+                self.aux_network = SFNetwork(use_fta=self.use_fta, script=script)
                 self.next_state_rep = InputReconstruction(use_fta=self.use_fta)
             elif self.use_aux == 'virtual-reward-1' or self.use_aux == 'virtual-reward-5':
-                self.aux_network = VirtualValueFunction(use_fta=self.use_fta)
-        
-        self.q_network_fc2 = nn.Linear(64, 64)
-        self.q_network_fc3 = nn.Linear(64, 4)
-        
+                self.aux_network = VirtualValueFunction(use_fta=self.use_fta, script=script)
+
+        self._register_load_state_dict_pre_hook(self._remap_legacy_keys)
+
+    def _remap_legacy_keys(self, state_dict, prefix, local_metadata, strict,
+                           missing_keys, unexpected_keys, error_msgs):
+
+        '''
+        loads checkpoints written before the heads were restructured: renamed
+        parameters move to their current keys, and buffers that did not exist
+        back then (the FTA tiling centers) are filled in from the freshly
+        initialized module, since their values only depend on the constructor
+        '''
+
+        for key in list(state_dict.keys()):
+            if not key.startswith(prefix):
+                continue
+            local = key[len(prefix):]
+            for old, new in self._legacy_key_map.items():
+                if local.startswith(old):
+                    state_dict[prefix + new + local[len(old):]] = state_dict.pop(key)
+                    break
+        for name, buffer in self.named_buffers():
+            if prefix + name not in state_dict:
+                state_dict[prefix + name] = buffer
+
     def forward(self, x):
-        
+
         rep = self.rep_net(x)
-        
+
         # auxilary network
-        aux = None
-        next_rep = None
-        
+        # zero-sized sentinels instead of None keep the returned structure
+        # static, so torch.compile can trace a single graph for every aux mode
+        aux = rep.new_zeros(0)
+        next_rep = rep.new_zeros(0)
+
         if self.use_aux != "no_aux":
             if self.use_aux == "reward":
                 aux = self.aux_network(rep)
@@ -171,13 +249,9 @@ class Network(nn.Module):
                 aux = self.aux_network(rep)
             elif self.use_aux == "virtual-reward-1" or self.use_aux == "virtual-reward-5":
                 aux = self.aux_network(rep)
-            else:
-                aux=None    
-                
+
         # value network
-        x = F.relu(self.q_network_fc1(rep))
-        x = F.relu(self.q_network_fc2(x))
-        x = self.q_network_fc3(x)
+        x = self.q_head(rep)
 
         return [x, aux, rep, next_rep]
     
\ No newline at end of file
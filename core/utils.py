@@ -1,25 +1,134 @@
-from collections import namedtuple, deque
-import random
 import numpy as np
 import torch
 import gymnasium as gym
 
-Transition = namedtuple('Transition',
-                        ('state', 'action', 'next_state', 'reward', 'next_action', 'virtual_reward'))
 
 class ReplayMemory(object):
-    
-    def __init__(self, capacity):
-        self.memory = deque([], maxlen=capacity)
 
-    def push(self, *args):
-        self.memory.append(Transition(*args))
+    '''
+    Struct-of-Arrays replay buffer
+
+    transitions are kept in tensors preallocated once for the whole capacity
+    (states, actions, rewards, next_states, next_actions, virtual_rewards plus
+    a valid_next mask for terminal transitions). the buffer itself lives in
+    pinned host memory so it does not consume GPU memory, and sampled
+    minibatches move to the training device with asynchronous copies issued on
+    a dedicated stream. push writes into a circular slot in-place and sample
+    draws a whole minibatch with a single torch.randint + advanced indexing,
+    so neither operation loops over transitions in Python.
+    '''
+
+    def __init__(self, capacity, state_shape, device):
+        self.capacity = capacity
+        self.device = torch.device(device)
+        pin = self.device.type == 'cuda'
+        # states are kept as uint8 images, 4x less memory and bandwidth than
+        # float32; the networks cast to float on their own forward pass
+        self.states = torch.zeros((capacity, *state_shape), dtype=torch.uint8, pin_memory=pin)
+        self.actions = torch.zeros((capacity, 1), dtype=torch.long, pin_memory=pin)
+        self.rewards = torch.zeros(capacity, dtype=torch.float32, pin_memory=pin)
+        self.next_states = torch.zeros((capacity, *state_shape), dtype=torch.uint8, pin_memory=pin)
+        self.next_actions = torch.zeros((capacity, 1), dtype=torch.long, pin_memory=pin)
+        self.virtual_rewards = torch.zeros(capacity, dtype=torch.float32, pin_memory=pin)
+        self.valid_next = torch.zeros(capacity, dtype=torch.bool, pin_memory=pin)
+        self._fields = {
+            'states': self.states,
+            'actions': self.actions,
+            'rewards': self.rewards,
+            'next_states': self.next_states,
+            'next_actions': self.next_actions,
+            'virtual_rewards': self.virtual_rewards,
+            'non_final_mask': self.valid_next,
+        }
+        self.copy_stream = torch.cuda.Stream() if pin else None
+        self._staging = None  # pinned gather buffers, sized on first sample
+        self._idx = None  # reused sample index tensor, sized on first sample
+        self.ptr = 0
+        self.size = 0
+
+    def push(self, state, action, next_state, reward, next_action=None, virtual_reward=None):
+        i = self.ptr
+        self.states[i].copy_(torch.as_tensor(state).view(self.states.shape[1:]))
+        self.actions[i].copy_(torch.as_tensor(action).view(1))
+        self.rewards[i].copy_(torch.as_tensor(reward).view(()))
+        if next_state is not None:
+            self.next_states[i].copy_(torch.as_tensor(next_state).view(self.next_states.shape[1:]))
+            self.valid_next[i] = True
+        else:
+            self.valid_next[i] = False
+        if next_action is not None:
+            self.next_actions[i].copy_(torch.as_tensor(next_action).view(1))
+        if virtual_reward is not None:
+            self.virtual_rewards[i].copy_(torch.as_tensor(virtual_reward).view(()))
+        self.ptr = (self.ptr + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _write(self, field, start, values):
+        # sliced copy with wrap-around at the end of the circular buffer
+        end = start + values.shape[0]
+        if end <= self.capacity:
+            field[start:end].copy_(values)
+        else:
+            split = self.capacity - start
+            field[start:self.capacity].copy_(values[:split])
+            field[:end - self.capacity].copy_(values[split:])
+
+    def push_batch(self, states, actions, next_states, rewards, next_actions=None, virtual_rewards=None):
+
+        '''
+        writes a whole batch of transitions (e.g. one per parallel env) with a
+        handful of sliced copies instead of one push call per transition; all
+        next states in a batched write are assumed non-final
+        '''
+
+        n = len(rewards)
+        start = self.ptr
+        self._write(self.states, start, torch.as_tensor(states))
+        self._write(self.actions, start, torch.as_tensor(actions).view(n, 1))
+        self._write(self.rewards, start, torch.as_tensor(rewards))
+        self._write(self.next_states, start, torch.as_tensor(next_states))
+        self._write(self.valid_next, start, torch.ones(n, dtype=torch.bool))
+        if next_actions is not None:
+            self._write(self.next_actions, start, torch.as_tensor(next_actions).view(n, 1))
+        if virtual_rewards is not None:
+            self._write(self.virtual_rewards, start, torch.as_tensor(virtual_rewards))
+        self.ptr = (start + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
 
     def sample(self, batch_size):
-        return random.sample(self.memory, batch_size)
+        # the index tensor is allocated once and refilled in-place, so steady
+        # state sampling does not allocate on the host at all
+        if self._idx is None or self._idx.shape[0] != batch_size:
+            self._idx = torch.empty(batch_size, dtype=torch.long)
+        idx = torch.randint(0, self.size, (batch_size,), out=self._idx)
+        if self.copy_stream is None:
+            return {name: field[idx] for name, field in self._fields.items()}
+
+        # make sure the previous minibatch finished copying before the pinned
+        # staging buffers are reused
+        self.copy_stream.synchronize()
+        if self._staging is None or self._staging['rewards'].shape[0] != batch_size:
+            self._staging = {name: torch.empty((batch_size, *field.shape[1:]), dtype=field.dtype, pin_memory=True)
+                             for name, field in self._fields.items()}
+
+        # gather into pinned staging buffers and issue the H2D copies on a
+        # dedicated stream, letting them overlap with compute on the main stream
+        batch = {}
+        with torch.cuda.stream(self.copy_stream):
+            for name, field in self._fields.items():
+                torch.index_select(field, 0, idx, out=self._staging[name])
+                batch[name] = self._staging[name].to(self.device, non_blocking=True)
+        torch.cuda.current_stream().wait_stream(self.copy_stream)
+        for tensor in batch.values():
+            # the device tensors were allocated on the copy stream but are
+            # consumed on the current stream; record that use so the caching
+            # allocator does not hand their memory back to a later sample's
+            # copies while the previous optimization step is still reading it
+            tensor.record_stream(torch.cuda.current_stream())
+        return batch
 
     def __len__(self):
-        return len(self.memory)
+        return self.size
     
 def pixel_replication(img, k):
     
@@ -38,35 +147,37 @@ def pixel_replication(img, k):
     return res
     
     
-def generate_random_trajectories(env:gym.Env, n=1000):
-    buffer = ReplayMemory(capacity=1000000)
+def generate_random_trajectories(env:gym.Env, n=1000, device='cpu'):
+    # states are stored as-is: uint8 HWC, matching what the networks expect
+    state_shape = env.observation_space.shape  # (H, W, C)
+    # capacity bounds the number of steps pushed: n episodes of at most 101 steps
+    buffer = ReplayMemory(capacity=n*101, state_shape=state_shape, device=device)
     for i in range(n):
         state, info = env.reset()
         done = False
         t = 0
         while not done:
-            state = state.transpose((2, 0, 1))
             action = env.action_space.sample()
             observation, reward, terminated, truncated, _ = env.step(action)
             buffer.push(state, action, observation, reward, None, None)
             t+=1
             done = terminated or truncated or t>100
-            
+
             state = observation
-            
+
     return buffer.sample(batch_size=n)
 
 def create_distance_matrices(env, model, n=1000):
-    random_transitions = generate_random_trajectories(env=env)
+    random_transitions = generate_random_trajectories(env=env, device=model.device)
 
     d_v = np.zeros((n, n))
     d_s = np.zeros((n, n))
-    
+
     for i in range (n):
         print(i)
-        temp_i = model.target_net(torch.tensor(random_transitions[i].state, dtype=torch.float32, device=model.device).unsqueeze(0))
+        temp_i = model.target_net(random_transitions['states'][i].unsqueeze(0))
         for j in range(i+1):
-            temp_j = model.target_net(torch.tensor(random_transitions[j].state, dtype=torch.float32, device=model.device).unsqueeze(0))
+            temp_j = model.target_net(random_transitions['states'][j].unsqueeze(0))
             d_v[i, j] = abs(temp_i[0].cpu().detach().numpy() - temp_j[0].cpu().detach().numpy()).max()
             a = np.array((temp_i[2].cpu().detach().numpy() - temp_j[2].cpu().detach().numpy()))
             d_s[i, j] = np.linalg.norm(a)
@@ -77,11 +188,11 @@ def create_distance_matrices(env, model, n=1000):
     return d_v, d_s
 
 def create_representations(env, model):
-    random_transitions = generate_random_trajectories(env=env)
+    random_transitions = generate_random_trajectories(env=env, device=model.device)
 
     reps = []
     for i in range(1000):
-        temp = model.target_net(torch.tensor(random_transitions[i].state, dtype=torch.float32, device=model.device).unsqueeze(0))
+        temp = model.target_net(random_transitions['states'][i].unsqueeze(0))
         rep = temp[2].cpu().detach().numpy()
         
         reps.append(rep)
@@ -13,8 +13,7 @@ def main(args):
     model_path = args.model_path
     env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode)
     model = Agent(env=env, args=args)
-    model.target_net.load_state_dict(torch.load(model_path))
-    model.policy_net.load_state_dict(torch.load(model_path))
+    model.load_model(model_path)
     
     d_v, d_s = create_distance_matrices(env, model)
     
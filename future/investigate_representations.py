@@ -63,8 +63,7 @@ def main(args):
     model = Agent(env=env, args=args)
     
 
-    model.target_net.load_state_dict(torch.load(model_path))
-    model.policy_net.load_state_dict(torch.load(model_path))
+    model.load_model(model_path)
     
     print('complexity reduction: ', complexity_reduction())
     
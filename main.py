@@ -10,15 +10,26 @@ import hydra
 # UP = 2
 # LEFT = 3
 
+def make_env(args):
+    '''
+    returns a thunk building a single MazEnv, as expected by AsyncVectorEnv
+    the horizon is enforced through the TimeLimit wrapper of gym.make
+    '''
+    def _make():
+        if args.use_aux == 'virtual-reward-1':
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=1, max_episode_steps=args.horizon)
+        elif args.use_aux == 'virtual-reward-5':
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=2, max_episode_steps=args.horizon)
+        else:
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, max_episode_steps=args.horizon)
+    return _make
+
 @hydra.main(config_path="config", config_name="config.yaml", version_base=None)
 def main(args):
-    if args.use_aux == 'virtual-reward-1':
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=1)
-    elif args.use_aux == 'virtual-reward-5':
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=2)
-    else:
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode)
-    
+    # run num_envs copies of the environment in parallel worker processes, so the
+    # step latency of a single env no longer bounds the training throughput
+    env = gym.vector.AsyncVectorEnv([make_env(args)] * args.num_envs)
+
     for i in range(args.runs):
         env.reset()
         agent = Agent(env=env, args=args)
@@ -27,4 +38,3 @@ def main(args):
 
 if __name__ == "__main__":
     main()
-
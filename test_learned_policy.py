@@ -16,18 +16,18 @@ def main(args):
     model = Agent(env=env, args=args)
     
 
-    model.target_net.load_state_dict(torch.load(model_path))
-    model.policy_net.load_state_dict(torch.load(model_path))
+    model.load_model(model_path)
     
     state, _ = env.reset()
     images = []
     for i in range(100):
-        state = state.transpose((2, 0, 1))
-        action = model.target_net(torch.tensor(state, device=model.device))[0].argmax().item()
+        # the networks take uint8 NHWC states straight from the environment
+        state_t = torch.from_numpy(state).unsqueeze(0).to(model.device)
+        action = model.target_net(state_t)[0].argmax().item()
 
-        print(model.target_net(torch.tensor(state, device=model.device))[0])
-        
-        image = Image.fromarray(pixel_replication(state.transpose((1, 2, 0)), 24), "RGB")
+        print(model.target_net(state_t)[0])
+
+        image = Image.fromarray(pixel_replication(state, 24), "RGB")
         images.append(image)
         print(action)
         next_state, reward, terminated, truncated, _ = env.step(action)
@@ -21,16 +21,16 @@ def main(args):
     
     model = Agent(env=env, args=args)
     
-    model.target_net.load_state_dict(torch.load(model_path))
-    model.policy_net.load_state_dict(torch.load(model_path))
+    model.load_model(model_path)
             
     state, _ = env.reset()
     images = []
     
-    state = state.transpose((2, 0, 1))
-    action = model.target_net(torch.tensor(state, device=model.device))[0].argmax().item()
+    # the networks take uint8 NHWC states straight from the environment
+    state_t = torch.from_numpy(state).unsqueeze(0).to(model.device)
+    action = model.target_net(state_t)[0].argmax().item()
 
-    numpy_image = np.array(model.target_net(torch.tensor(state, device=model.device))[1].squeeze().cpu().detach().numpy())
+    numpy_image = np.array(model.target_net(state_t)[1].squeeze().cpu().detach().numpy())
     numpy_image = (numpy_image/255.0).round()*255.0
     numpy_image = np.array(numpy_image, dtype=np.uint8)
     
@@ -7,23 +7,31 @@ from core.utils import *
 import numpy as np
 
 
+def make_env(args):
+    '''
+    returns a thunk building a single MazEnv, as expected by AsyncVectorEnv
+    the horizon is enforced through the TimeLimit wrapper of gym.make
+    '''
+    def _make():
+        if args.use_aux == 'virtual-reward-1':
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=1, max_episode_steps=args.horizon)
+        elif args.use_aux == 'virtual-reward-5':
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=2, max_episode_steps=args.horizon)
+        else:
+            return gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, max_episode_steps=args.horizon)
+    return _make
+
 @hydra.main(config_path="config", config_name="transfer_config.yaml", version_base=None)
 def main(args):
     model_path = args.model_path
-    if args.use_aux == 'virtual-reward-1':
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=1)
-    elif args.use_aux == 'virtual-reward-5':
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode, virtual_goal=2)
-    else:
-        env = gym.make('core:MazEnv-v0', goal_mode=args.goal_mode)
-    
+    env = gym.vector.AsyncVectorEnv([make_env(args)] * args.num_envs)
+
     for i in range(args.runs):
         model = Agent(env=env, args=args)
         
 
-        model.target_net.load_state_dict(torch.load(model_path))
-        model.policy_net.load_state_dict(torch.load(model_path))
-        
+        model.load_model(model_path)
+
         # The first 8 params are weights and biases of representation network
         for i, param in enumerate(model.policy_net.parameters()):
             if i < 8: